@@ -1,9 +1,12 @@
 import logging
+import pickle
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
 import asyncio
 import configparser
-from ib_async import Contract, util
+from ib_async import Contract
 
 # Importa la nuova classe dal file che abbiamo creato
 from connection_manager import ConnectionManager
@@ -11,17 +14,52 @@ from connection_manager import ConnectionManager
 from ai_analyst import AiAnalyst
 
 # --- Configurazione del Logging Professionale ---
+# I log passano da una coda: la scrittura su file/console avviene in un thread separato
+# e non blocca l'event loop durante l'elaborazione delle barre.
 log_file = Path(__file__).parent / 'trading_agent.log'
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue = queue.Queue(-1)
+log_listener = QueueListener(_log_queue, *_log_handlers)
+log_listener.start()
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+_root_logger.addHandler(QueueHandler(_log_queue))
 # Riduci la verbosità dei log interni di ib_async per vedere solo gli avvisi/errori
-util.logToConsole(logging.WARNING)
+logging.getLogger('ib_async').setLevel(logging.WARNING)
+
+# Contratto qualificato salvato tra un avvio e l'altro per evitare il round-trip a IB
+CONTRACT_CACHE_FILE = Path(__file__).parent / '.contract.cache'
+
+
+def _contract_fingerprint(contract: Contract) -> tuple:
+    return (contract.symbol, contract.secType, contract.exchange, contract.currency)
+
+
+def load_cached_contract(fingerprint: tuple):
+    """Carica il contratto qualificato dalla cache se corrisponde alla configurazione attuale."""
+    if not CONTRACT_CACHE_FILE.exists():
+        return None
+    try:
+        with open(CONTRACT_CACHE_FILE, 'rb') as f:
+            cached = pickle.load(f)
+    except Exception as exc:
+        logging.warning("Cache del contratto non leggibile, verrà rigenerata: %s", exc)
+        return None
+    if cached.get('fingerprint') != fingerprint or not cached['contract'].conId:
+        return None
+    return cached['contract']
+
+
+def save_cached_contract(fingerprint: tuple, contract: Contract) -> None:
+    """Salva il contratto qualificato per i successivi avvii."""
+    try:
+        with open(CONTRACT_CACHE_FILE, 'wb') as f:
+            pickle.dump({'fingerprint': fingerprint, 'contract': contract}, f)
+    except OSError as exc:
+        logging.warning("Impossibile salvare la cache del contratto: %s", exc)
 
 
 async def main():
@@ -82,35 +120,56 @@ async def main():
         contract.exchange = strategy_config.get('exchange', 'IDEALPRO')
         contract.currency = strategy_config.get('currency', 'USD')
         
-        # Qualifica il contratto usando l'istanza di IB dal connection manager
-        await conn_manager.ib.qualifyContractsAsync(contract)
-        logging.info(f"Contratto qualificato con successo: {contract.localSymbol}")
-
-        # --- CORREZIONE: "Sveglia" la connessione dati di mercato per questo contratto ---
-        logging.info("Attivazione del flusso dati di mercato per il contratto...")
-        conn_manager.ib.reqMktData(contract, '', False, False)
-        await asyncio.sleep(2)  # Attendi 2 secondi per permettere l'attivazione
-        conn_manager.ib.cancelMktData(contract)
-        logging.info("Flusso dati di mercato attivato.")
-
-        async def handle_new_bar(symbol, bar_snapshot):
-            last_bar = bar_snapshot[-1]
+        # Riusa il contratto qualificato in un avvio precedente, se la configurazione non è cambiata
+        fingerprint = _contract_fingerprint(contract)
+        cached_contract = load_cached_contract(fingerprint)
+        if cached_contract is not None:
+            contract = cached_contract
+            logging.info(f"Contratto caricato dalla cache: {contract.localSymbol}")
+        else:
+            # Qualifica il contratto usando l'istanza di IB dal connection manager
+            await conn_manager.ib.qualifyContractsAsync(contract)
+            logging.info(f"Contratto qualificato con successo: {contract.localSymbol}")
+            if contract.conId:
+                save_cached_contract(fingerprint, contract)
+
+        symbol = contract.symbol
+
+        def log_bar(symbol, last_bar):
             logging.info(
                 "Nuova barra %s | O=%.5f H=%.5f L=%.5f C=%.5f",
                 symbol, last_bar.open, last_bar.high, last_bar.low, last_bar.close
             )
-            decision, reason = await ai_analyst.get_trading_decision(bar_snapshot)
-            logging.info("Decisione AI per %s: %s (%s)", symbol, decision, reason)
 
-        def on_bar_update(bars, has_new_bar):
-            if not has_new_bar:
-                return
-            snapshot = list(bars)
-            symbol = getattr(bars.contract, "symbol", "UNKNOWN")
-            asyncio.create_task(handle_new_bar(symbol, snapshot))
+        async def handle_new_bar(symbol, last_bar):
+            log_bar(symbol, last_bar)
+            decision, reason = await ai_analyst.get_trading_decision(last_bar)
+            logging.info("Decisione AI per %s: %s (%s)", symbol, decision, reason)
 
+        # Handler chiamato a ogni barra: riferimenti legati come default per evitare lookup ripetuti,
+        # e solo l'ultima barra passata all'analista (che mantiene lo storico delle chiusure).
+        if ai_analyst.llm_chain is None:
+            # Senza LLM la decisione è sincrona: nessun task da creare
+            def on_bar_update(bars, has_new_bar, _sym=symbol, _decide=ai_analyst.get_technical_decision):
+                if has_new_bar:
+                    last_bar = bars[-1]
+                    log_bar(_sym, last_bar)
+                    decision, reason = _decide(last_bar)
+                    logging.info("Decisione AI per %s: %s (%s)", _sym, decision, reason)
+        else:
+            def on_bar_update(bars, has_new_bar, _sym=symbol, _h=handle_new_bar,
+                              _create=asyncio.get_running_loop().create_task):
+                if has_new_bar:
+                    _create(_h(_sym, bars[-1]))
+
+        # La qualificazione del contratto basta a preparare la sottoscrizione: niente warm-up con reqMktData
         bars = conn_manager.ib.reqRealTimeBars(contract, 5, 'MIDPOINT', False)
         bars.updateEvent += on_bar_update
+        try:
+            await asyncio.wait_for(bars.updateEvent, 10.0)
+            logging.info("Flusso dati di mercato attivo.")
+        except asyncio.TimeoutError:
+            logging.warning("Nessuna barra ricevuta entro 10 secondi: verificare i permessi dati di mercato.")
 
         # 5. Mantiene l'agente in esecuzione per ascoltare gli eventi
         logging.info("Agente avviato correttamente. In attesa di dati di mercato... Premere Ctrl+C per terminare.")
@@ -133,3 +192,6 @@ if __name__ == "__main__":
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logging.info("Programma terminato dall'utente.")
+    finally:
+        # Svuota la coda dei log prima di uscire
+        log_listener.stop()
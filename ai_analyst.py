@@ -1,8 +1,12 @@
+import asyncio
 import json
 import logging
 import os
+import pickle
+import re
+from collections import OrderedDict, deque
+from functools import lru_cache
 from pathlib import Path
-from statistics import mean
 from typing import List, Sequence, Tuple
 
 try:
@@ -10,6 +14,21 @@ try:
 except ImportError:
     load_dotenv = None
 
+try:
+    import orjson as _json
+except ImportError:
+    _json = json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
 try:
     import chromadb
 except ImportError:
@@ -19,13 +38,31 @@ try:
     from langchain.prompts import PromptTemplate
     from langchain_core.output_parsers import StrOutputParser
     from langchain_core.runnables import RunnableLambda, RunnableParallel
-    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 except ImportError:
     PromptTemplate = None
     StrOutputParser = None
     RunnableLambda = None
     RunnableParallel = None
     ChatGoogleGenerativeAI = None
+    GoogleGenerativeAIEmbeddings = None
+
+# Finestre delle medie mobili; il buffer circolare delle chiusure copre la più lunga
+SHORT_WINDOW = 5
+LONG_WINDOW = 20
+# Numero massimo di decisioni LLM memorizzate (chiave: impronta delle ultime chiusure)
+DECISION_CACHE_SIZE = 256
+# Finestra (secondi) in cui le richieste LLM concorrenti vengono raggruppate in un unico abatch
+LLM_BATCH_WINDOW = 0.05
+# Indice denso salvato da knowledge_builder accanto al DB Chroma (che importa questi nomi da qui)
+DENSE_VECTORS_FILE = "embeddings_int8.npy"
+DENSE_SCALES_FILE = "scales.npy"
+DENSE_DOCS_FILE = "metadatas.pkl"
+DENSE_FAISS_FILE = "faiss_sq8.index"
+EMBEDDING_MODEL = "models/text-embedding-004"
+KNOWLEDGE_RESULTS = 2
+# Le motivazioni tecniche differiscono solo per i numeri: normalizzati, ricadono su pochi template
+_QUERY_NUMBERS = re.compile(r"[-+]?\d+(?:\.\d+)?")
 
 
 class AiAnalyst:
@@ -45,13 +82,36 @@ class AiAnalyst:
             load_dotenv()
         self.strategy_version = strategy_version
         self.model_name = model_name
+        self._decision_cache: "OrderedDict[Tuple, Tuple[str, str]]" = OrderedDict()
+        self._pending: List[Tuple[asyncio.Future, dict]] = []
+        self._flush_task = None
+        self._last_decision = None
+        self._closes: "deque[float]" = deque(maxlen=LONG_WINDOW)
+        self._bars_seen = 0
+        self._init_embeddings()
         self._init_vector_store()
         self._init_llm_chain()
         logging.info("Analista AI inizializzato (strategy=%s, llm=%s)",
                      self.strategy_version,
                      "ON" if self.llm_chain else "OFF")
 
-    async def get_trading_decision(self, bars: Sequence) -> Tuple[str, str]:
+    def update_close(self, close: float) -> None:
+        """Aggiunge una chiusura al buffer circolare (O(1), nessuna copia della serie)."""
+        self._closes.append(close)
+        self._bars_seen += 1
+
+    def get_technical_decision(self, last_bar) -> Tuple[str, str]:
+        """
+        Aggiorna il buffer delle chiusure e restituisce il solo segnale tecnico.
+
+        Percorso sincrono usato quando l'LLM non è configurato.
+        """
+        self.update_close(last_bar.close)
+        if self._bars_seen < SHORT_WINDOW:
+            return "HOLD", f"Serie di barre insufficiente (<{SHORT_WINDOW})."
+        return self._technical_signal(list(self._closes))
+
+    async def get_trading_decision(self, last_bar) -> Tuple[str, str]:
         """
         Analizza i dati delle barre e restituisce una decisione di trading.
         
@@ -59,20 +119,30 @@ class AiAnalyst:
         Per ora, implementa una logica di fallback di base.
 
         Args:
-            bars (list): Una lista di barre di dati di mercato.
+            last_bar: La nuova barra ricevuta; la sua chiusura viene aggiunta
+                      al buffer delle chiusure recenti.
 
         Returns:
             tuple: Una tupla contenente la decisione ('BUY', 'SELL', 'HOLD')
                    e una breve motivazione.
         """
-        closes = self._extract_closes(bars)
-        if len(closes) < 5:
-            return "HOLD", "Serie di barre insufficiente (<5)."
-        base_decision, base_reason = self._technical_signal(closes)
-        if not self.llm_chain:
+        base_decision, base_reason = self.get_technical_decision(last_bar)
+        if not self.llm_chain or self._bars_seen < SHORT_WINDOW:
             return base_decision, base_reason
+        closes = list(self._closes)
+        # HOLD dopo HOLD: nessun cambio di segnale, la chiamata LLM non è necessaria
+        if base_decision == "HOLD" and self._last_decision == "HOLD":
+            return base_decision, base_reason
+
+        # Barre quasi identiche alle precedenti riusano la decisione già ottenuta dall'LLM
+        cache_key = (self.strategy_version, base_decision, tuple(round(c, 5) for c in closes))
+        cached = self._decision_cache.get(cache_key)
+        if cached is not None:
+            self._decision_cache.move_to_end(cache_key)
+            self._last_decision = cached[0]
+            return cached
 
-        technical_context = self._build_context(bars, closes, base_reason)
+        technical_context = self._build_context(last_bar, closes, base_reason)
         knowledge = self._fetch_knowledge(base_reason)
         try:
             llm_payload = {
@@ -80,25 +150,55 @@ class AiAnalyst:
                 "signal_context": technical_context,
                 "knowledge": knowledge or "N/A"
             }
-            response = await self.llm_chain.ainvoke(llm_payload)
+            response = await self._invoke_llm(llm_payload)
             parsed = self._parse_llm_response(response)
             if parsed:
-                return parsed["decision"], parsed["reason"]
+                result = (parsed["decision"], parsed["reason"])
+                self._remember_decision(cache_key, result)
+                self._last_decision = result[0]
+                return result
         except Exception as exc:
             logging.warning("LLM non disponibile, uso fallback. Dettagli: %s", exc)
+        self._last_decision = base_decision
         return base_decision, base_reason
 
-    def _extract_closes(self, bars: Sequence) -> List[float]:
-        closes: List[float] = []
-        for bar in bars:
-            close = getattr(bar, "close", None)
-            if close is not None:
-                closes.append(close)
-        return closes
+    async def _invoke_llm(self, payload: dict) -> str:
+        """Accoda il prompt e attende la risposta del prossimo abatch."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((future, payload))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_pending())
+        return await future
+
+    async def _flush_pending(self) -> None:
+        """
+        Invia in un'unica chiamata tutti i prompt arrivati entro LLM_BATCH_WINDOW.
+        I prompt accodati mentre abatch è in corso vengono inviati nel giro successivo.
+        """
+        while self._pending:
+            await asyncio.sleep(LLM_BATCH_WINDOW)
+            batch, self._pending = self._pending, []
+            try:
+                responses = await self.llm_chain.abatch([payload for _, payload in batch], return_exceptions=True)
+            except Exception as exc:
+                responses = [exc] * len(batch)
+            for (future, _), response in zip(batch, responses):
+                if future.done():
+                    continue
+                if isinstance(response, Exception):
+                    future.set_exception(response)
+                else:
+                    future.set_result(response)
+
+    def _remember_decision(self, key: Tuple, result: Tuple[str, str]) -> None:
+        self._decision_cache[key] = result
+        if len(self._decision_cache) > DECISION_CACHE_SIZE:
+            self._decision_cache.popitem(last=False)
 
     def _technical_signal(self, closes: Sequence[float]) -> Tuple[str, str]:
-        short_ma = mean(closes[-5:])
-        long_ma = mean(closes[-20:]) if len(closes) >= 20 else short_ma
+        # Finestre fisse e piccole: sum()/n evita l'overhead di statistics.mean
+        short_ma = sum(closes[-SHORT_WINDOW:]) / SHORT_WINDOW
+        long_ma = sum(closes[-LONG_WINDOW:]) / LONG_WINDOW if len(closes) >= LONG_WINDOW else short_ma
         momentum = closes[-1] - closes[-2]
         spread = short_ma - long_ma
         if spread > 0 and momentum > 0:
@@ -107,8 +207,7 @@ class AiAnalyst:
             return "SELL", f"ShortMA ({short_ma:.5f}) sotto LongMA ({long_ma:.5f}) con momentum negativo ({momentum:.5f})."
         return "HOLD", f"Segnali contrastanti (ΔMA={spread:.5f}, momentum={momentum:.5f})."
 
-    def _build_context(self, bars: Sequence, closes: Sequence[float], reason: str) -> str:
-        last_bar = bars[-1]
+    def _build_context(self, last_bar, closes: Sequence[float], reason: str) -> str:
         high = getattr(last_bar, "high", None)
         low = getattr(last_bar, "low", None)
         volume = getattr(last_bar, "volume", None)
@@ -116,13 +215,38 @@ class AiAnalyst:
             f"Ultima chiusura: {closes[-1]:.5f}\n"
             f"Motivazione tecnica: {reason}\n"
             f"High/Low: {high}, {low} | Volume: {volume}\n"
-            f"Numero barre disponibili: {len(closes)}"
+            f"Numero barre disponibili: {self._bars_seen}"
         )
 
+    def _init_embeddings(self) -> None:
+        self.embeddings = None
+        api_key = os.getenv("GEMINI_API_KEY")
+        if GoogleGenerativeAIEmbeddings and api_key:
+            self.embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=api_key)
+        # Cache per istanza: evita di ripetere la chiamata remota di embedding per lo stesso template
+        self._embed_cached = lru_cache(maxsize=1024)(self._embed_query)
+
     def _init_vector_store(self) -> None:
+        # Il caricamento vero e proprio è rinviato alla prima query (vedi _ensure_vector_store):
+        # le sessioni che non interrogano mai la conoscenza non pagano tempo di avvio né RAM.
         self.vector_store = None
-        db_path = Path(__file__).parent / "chroma_db"
-        if chromadb and db_path.exists():
+        self._dense_vectors = None
+        self._dense_scales = None
+        self._dense_documents: List[str] = []
+        self._faiss_index = None
+        self._vs_path = Path(__file__).parent / "chroma_db"
+        self._vs_loaded = False
+
+    def _ensure_vector_store(self) -> None:
+        if self._vs_loaded:
+            return
+        self._vs_loaded = True
+        db_path = self._vs_path
+        if not db_path.exists():
+            return
+        if self._init_dense_index(db_path):
+            return
+        if chromadb:
             try:
                 client = chromadb.PersistentClient(path=str(db_path))
                 self.vector_store = client.get_or_create_collection("ebooks_knowledge")
@@ -130,11 +254,80 @@ class AiAnalyst:
             except Exception as exc:
                 logging.warning("Impossibile inizializzare Chroma DB: %s", exc)
 
+    def _init_dense_index(self, db_path: Path) -> bool:
+        """
+        Carica l'indice denso (embedding normalizzati, quantizzati int8, in mmap) e, se presente,
+        l'indice FAISS salvato da knowledge_builder; senza FAISS il punteggio si calcola sui codici int8.
+        """
+        vectors_path = db_path / DENSE_VECTORS_FILE
+        scales_path = db_path / DENSE_SCALES_FILE
+        docs_path = db_path / DENSE_DOCS_FILE
+        if np is None or not self.embeddings or not all(p.exists() for p in (vectors_path, scales_path, docs_path)):
+            return False
+        try:
+            codes = np.load(vectors_path, mmap_mode="r")
+            scales = np.load(scales_path)
+            with open(docs_path, "rb") as f:
+                self._dense_documents = pickle.load(f)["documents"]
+            faiss_path = db_path / DENSE_FAISS_FILE
+            if faiss and faiss_path.exists():
+                # Indice già costruito da knowledge_builder: nessuna dequantizzazione né nuovo addestramento
+                index = faiss.read_index(str(faiss_path))
+                if index.ntotal == codes.shape[0]:
+                    self._faiss_index = index
+                else:
+                    logging.warning("Indice FAISS non allineato ai documenti (%d vs %d), uso NumPy.",
+                                    index.ntotal, codes.shape[0])
+            self._dense_vectors = codes
+            self._dense_scales = scales
+            logging.info("Indice denso inizializzato da %s (%d vettori int8, backend=%s)",
+                         db_path, codes.shape[0], "FAISS" if self._faiss_index else "NumPy")
+            return True
+        except Exception as exc:
+            logging.warning("Impossibile caricare l'indice denso, uso Chroma DB: %s", exc)
+            self._dense_vectors = None
+            self._dense_scales = None
+            self._dense_documents = []
+            self._faiss_index = None
+            return False
+
+    def _embed_query(self, query: str):
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _query_vector(self, query: str):
+        return self._embed_cached(_QUERY_NUMBERS.sub("#", query))
+
+    def _dense_search(self, query_vector, k: int) -> List[int]:
+        if self._faiss_index is not None:
+            _, ids = self._faiss_index.search(query_vector[None, :], k)
+            return [int(i) for i in ids[0] if i >= 0]
+        # Prodotto scalare direttamente sui codici int8, riportato in scala per vettore
+        scores = (self._dense_vectors @ query_vector) / self._dense_scales
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])].tolist()
+
     def _fetch_knowledge(self, query: str) -> str:
+        self._ensure_vector_store()
+        if self._dense_vectors is not None:
+            try:
+                ids = self._dense_search(self._query_vector(query), KNOWLEDGE_RESULTS)
+                return "\n".join(self._dense_documents[i] for i in ids)
+            except Exception as exc:
+                logging.warning("Errore durante la ricerca nell'indice denso: %s", exc)
+                return ""
         if not self.vector_store:
             return ""
         try:
-            result = self.vector_store.query(query_texts=[query], n_results=2)
+            if self.embeddings and np is not None:
+                result = self.vector_store.query(
+                    query_embeddings=[self._query_vector(query).tolist()],
+                    n_results=KNOWLEDGE_RESULTS
+                )
+            else:
+                result = self.vector_store.query(query_texts=[query], n_results=KNOWLEDGE_RESULTS)
             docs = result.get("documents", [[]])[0]
             return "\n".join(docs)
         except Exception as exc:
@@ -168,7 +361,9 @@ class AiAnalyst:
 
     def _parse_llm_response(self, response: str):
         try:
-            parsed = json.loads(response)
+            # I modelli spesso racchiudono il JSON in un blocco ```json ... ```
+            payload = response.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+            parsed = _json.loads(payload)
             decision = parsed.get("decision", "").upper()
             if decision in {"BUY", "SELL", "HOLD"}:
                 return {"decision": decision, "reason": parsed.get("reason", "").strip()}
@@ -1,6 +1,7 @@
 import os
+import re
 import sys
-import socket
+import asyncio
 import configparser
 from pathlib import Path
 
@@ -16,20 +17,36 @@ def _pkg_version(name: str):
     except Exception:
         return None
 
+async def _probe_port(host: str, port: int, timeout: float = 2.0) -> bool:
+    """Tenta una connessione TCP non bloccante alla porta indicata."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except Exception:
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return True
+
+async def _probe_ports(ports: list) -> list:
+    return await asyncio.gather(*(_probe_port("127.0.0.1", p) for p in ports))
+
 def check_tws_ports():
-    """Verifica le porte comuni TWS/Gateway."""
+    """Verifica le porte comuni TWS/Gateway (in parallelo: al massimo un timeout di attesa)."""
     ports = {
         7496: "TWS Paper Trading",
         7497: "TWS Live Trading",
         4001: "Gateway Paper Trading", 
         4002: "Gateway Live Trading"
     }
+    reachable = asyncio.run(_probe_ports(list(ports)))
     results = {}
-    for port, desc in ports.items():
-        try:
-            with socket.create_connection(("127.0.0.1", port), timeout=2.0):
-                results[port] = f"✅ {desc} ({port}): RAGGIUNGIBILE"
-        except Exception:
+    for (port, desc), ok in zip(ports.items(), reachable):
+        if ok:
+            results[port] = f"✅ {desc} ({port}): RAGGIUNGIBILE"
+        else:
             results[port] = f"❌ {desc} ({port}): NON RAGGIUNGIBILE"
     return results
 
@@ -40,7 +57,8 @@ def check_dependencies():
         "python-dotenv": "Richiesto per .env",
         "langchain": "Opzionale per AI",
         "langchain-google-genai": "Opzionale per Gemini (nome pacchetto possibile diverso)",
-        "chromadb": "Opzionale per RAG"
+        "chromadb": "Opzionale per RAG",
+        "faiss-cpu": "Opzionale per RAG (ricerca veloce nell'indice denso)"
     }
     results = {}
     for pkg, desc in deps.items():
@@ -153,8 +171,13 @@ def suggest_install_commands(results: dict) -> list:
         optional.append("pip install langchain-google-genai")
     if results.get('chromadb', '').startswith('⚠️') or 'NON INSTALLATO' in results.get('chromadb', ''):
         optional.append("pip install chromadb")
+    if 'NON INSTALLATO' in results.get('faiss-cpu', ''):
+        optional.append("pip install faiss-cpu")
     return cmds + optional
 
+_ALLOW_RE = re.compile(r"Consenti|Allow", re.I)
+_BLOCK_RE = re.compile(r"Blocca|Deny|Bloccato", re.I)
+
 def analyze_firewall_file(path: str = "porte.txt", ports: list = None) -> dict:
     """Cerca nel file firewall (porte.txt) regole che menzionano le porte indicate."""
     if ports is None:
@@ -167,18 +190,21 @@ def analyze_firewall_file(path: str = "porte.txt", ports: list = None) -> dict:
             text = f.read()
     except Exception:
         return results
-    lines = text.splitlines()
-    for p in ports:
-        matches = []
-        for ln in lines:
-            if str(p) in ln:
-                state = "UNKNOWN"
-                if "Consenti" in ln or "Allow" in ln:
-                    state = "CONSENTITO"
-                if "Blocca" in ln or "Bloccare" in ln or "Deny" in ln or "Bloccato" in ln:
-                    state = "BLOCCATO"
-                matches.append((state, ln.strip()))
-        results[p] = matches
+    # Una sola regex per riga; \b evita falsi positivi come 24001 per la porta 4001
+    port_re = re.compile(r"\b(" + "|".join(map(str, ports)) + r")\b")
+    results = {p: [] for p in ports}
+    for ln in text.splitlines():
+        found = set(port_re.findall(ln))
+        if not found:
+            continue
+        state = "UNKNOWN"
+        if _BLOCK_RE.search(ln):
+            state = "BLOCCATO"
+        elif _ALLOW_RE.search(ln):
+            state = "CONSENTITO"
+        for p in ports:
+            if str(p) in found:
+                results[p].append((state, ln.strip()))
     return results
 
 def main():
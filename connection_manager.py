@@ -1,5 +1,7 @@
 import logging
 import asyncio
+import random
+import socket
 from ib_async import IB
 
 class ConnectionManager:
@@ -7,13 +9,17 @@ class ConnectionManager:
     Gestisce il ciclo di vita della connessione con IB Gateway,
     inclusa la logica di riconnessione automatica.
     """
+    # Codici IB puramente informativi (stato delle farm dati), da non registrare come errori
+    INFORMATIONAL_CODES = frozenset({2104, 2106, 2107, 2108, 2119, 2158})
+
     def __init__(self, host: str, port: int, client_id: int):
         self.ib = IB()
         self._host = host
         self._port = port
         self._client_id = client_id
         self._connection_retries = 5
-        self._retry_delay = 10  # Secondi
+        self._retry_delay = 2  # Secondi, raddoppiato a ogni tentativo
+        self._max_retry_delay = 60  # Secondi
         self._register_event_handlers()
 
     def _register_event_handlers(self):
@@ -35,21 +41,44 @@ class ConnectionManager:
     def on_error(self, reqId, errorCode, errorString, contract=None):
         """Gestisce gli errori API, escludendo i messaggi informativi."""
         # CORREZIONE: Ignora i codici informativi comuni (es. 2104, 2106, 2158)
-        informational_codes = {2104, 2106, 2108, 2158}
-        if errorCode not in informational_codes:
+        if errorCode not in self.INFORMATIONAL_CODES:
             logging.error(f"Errore API IB: reqId={reqId}, Code={errorCode}, Msg='{errorString}'")
 
+    async def _resolve_host(self) -> str:
+        """
+        Risolve l'host una sola volta, così i tentativi successivi non ripetono la query DNS.
+        L'indirizzo viene fissato solo se è un unico IPv4: con più indirizzi (es. localhost -> ::1 e
+        127.0.0.1) si passa il nome host, così la connessione li prova tutti in ordine.
+        """
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(self._host, self._port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            logging.warning(f"Risoluzione di {self._host} fallita ({e}), uso il nome host.")
+            return self._host
+        addresses = {(family, sockaddr[0]) for family, _, _, _, sockaddr in infos}
+        if len(addresses) == 1:
+            family, address = addresses.pop()
+            if family == socket.AF_INET:
+                return address
+        return self._host
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Backoff esponenziale troncato con jitter (tra 0.5x e 1.5x del ritardo nominale)."""
+        delay = min(self._retry_delay * 2 ** (attempt - 1), self._max_retry_delay)
+        return delay * (0.5 + random.random())
+
     async def connect(self):
         """Tenta la connessione con logica di re-tentativo."""
+        address = await self._resolve_host()
         for attempt in range(1, self._connection_retries + 1):
             try:
                 logging.info(f"Tentativo {attempt}/{self._connection_retries} di connessione a {self._host}:{self._port}...")
-                await self.ib.connectAsync(self._host, self._port, clientId=self._client_id, timeout=15)
+                await self.ib.connectAsync(address, self._port, clientId=self._client_id, timeout=15)
                 return True # Ritorna True se la connessione ha successo
             except (ConnectionRefusedError, asyncio.TimeoutError) as e:
                 logging.error(f"Connessione fallita: {e}. Assicurarsi che IB Gateway sia in esecuzione sulla porta corretta.")
                 if attempt < self._connection_retries:
-                    await asyncio.sleep(self._retry_delay)
+                    await asyncio.sleep(self._backoff_delay(attempt))
             except Exception as e:
                 logging.critical(f"Errore di connessione imprevisto: {e}")
                 break
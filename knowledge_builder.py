@@ -1,15 +1,26 @@
 import os
+import pickle
 import shutil
 import logging
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Sequence, Tuple
+import numpy as np
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader  # type: ignore
 from langchain_google_genai import GoogleGenerativeAIEmbeddings  # type: ignore
 from langchain_text_splitters import RecursiveCharacterTextSplitter  # type: ignore
 from langchain_community.vectorstores import Chroma  # type: ignore
 from langchain_core.documents import Document  # type: ignore
+# Nomi dei file dell'indice denso e modello di embedding: definiti una sola volta in ai_analyst,
+# che legge l'indice, così builder e lettore restano allineati
+from ai_analyst import (DENSE_DOCS_FILE, DENSE_FAISS_FILE, DENSE_SCALES_FILE, DENSE_VECTORS_FILE,
+                        EMBEDDING_MODEL)
 # NOTA: Potrebbe essere necessario installare 'chromadb' se non già presente
 # pip install chromadb
+try:
+    import faiss  # type: ignore
+except ImportError:
+    faiss = None
 
 # --- CONFIGURAZIONE E CARICAMENTO CHIAVI ---
 load_dotenv() 
@@ -21,43 +32,80 @@ VECTOR_DB_DIR = "chroma_db"
 # --- CONFIGURAZIONE SPLITTER ---
 CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 150
+# Testi per singola richiesta di embedding a Gemini
+EMBED_BATCH_SIZE = 100
+
+def _build_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+
+def _load_and_split_pdf(filepath: str) -> Tuple[int, List[Document]]:
+    """Carica e divide un singolo PDF (eseguita in un processo separato)."""
+    docs = PyPDFLoader(filepath).load()
+    return len(docs), _build_text_splitter().split_documents(docs)
 
 def load_and_split_documents(directory: str) -> List[Document]:
     """Carica tutti i PDF dalla directory e li divide in frammenti (chunks)."""
     
     logging.info(f"Caricamento documenti dalla directory: {directory}...")
-    documents: List[Document] = []
+    chunks: List[Document] = []
     
     pdf_files = [f for f in os.listdir(directory) if f.lower().endswith(".pdf")]
     if not pdf_files:
         logging.warning(f"Nessun file PDF trovato in '{directory}'.")
         return []
 
-    for filename in pdf_files:
-        filepath = os.path.join(directory, filename)
-        try:
-            loader = PyPDFLoader(filepath)
-            docs = loader.load()
-            logging.info(f"Caricato {filename} ({len(docs)} pagine).")
-            documents.extend(docs)
-        except Exception as e:
-            logging.error(f"Errore nel caricamento di {filename}: {e}")
-
-    if not documents:
+    # Il parsing dei PDF è CPU-bound: un processo per file sfrutta tutti i core
+    filepaths = [os.path.join(directory, filename) for filename in pdf_files]
+    loaded_files = 0
+    with ProcessPoolExecutor(max_workers=min(len(filepaths), os.cpu_count() or 1)) as executor:
+        # Risultati raccolti nell'ordine dei file per mantenere stabile l'ordine dei chunks
+        futures = [(name, executor.submit(_load_and_split_pdf, path)) for path, name in zip(filepaths, pdf_files)]
+        for filename, future in futures:
+            try:
+                n_pages, file_chunks = future.result()
+                logging.info(f"Caricato {filename} ({n_pages} pagine).")
+                chunks.extend(file_chunks)
+                loaded_files += 1
+            except Exception as e:
+                logging.error(f"Errore nel caricamento di {filename}: {e}")
+
+    if not loaded_files:
         logging.error("Nessun documento è stato caricato. Interruzione.")
         return []
 
-    # Configurazione dello splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
-    
-    chunks = text_splitter.split_documents(documents)
     logging.info(f"Documenti divisi in {len(chunks)} 'chunks' (frammenti).")
     return chunks
 
+def quantize_int8(vecs: np.ndarray):
+    """Quantizzazione simmetrica int8 con una scala per vettore: vecs ≈ codes / scales."""
+    max_abs = np.max(np.abs(vecs), axis=1)
+    scales = (127.0 / np.where(max_abs == 0, 1.0, max_abs)).astype(np.float32)
+    codes = np.round(vecs * scales[:, None]).astype(np.int8)
+    return codes, scales
+
+def save_dense_index(vectors: Sequence, documents: Sequence[str], metadatas: Sequence[dict]) -> None:
+    """Salva embedding L2-normalizzati quantizzati a int8 e testi per la ricerca a prodotto scalare."""
+    vecs = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    vecs /= np.where(norms == 0, 1.0, norms)
+    codes, scales = quantize_int8(vecs)
+    np.save(os.path.join(VECTOR_DB_DIR, DENSE_VECTORS_FILE), codes)
+    np.save(os.path.join(VECTOR_DB_DIR, DENSE_SCALES_FILE), scales)
+    with open(os.path.join(VECTOR_DB_DIR, DENSE_DOCS_FILE), 'wb') as f:
+        pickle.dump({"documents": list(documents), "metadatas": list(metadatas)}, f)
+    if faiss is not None:
+        # Indice FAISS costruito una sola volta qui, addestrando lo ScalarQuantizer a 8 bit
+        # sui vettori originali (una sola quantizzazione); AiAnalyst lo legge con read_index
+        index = faiss.IndexScalarQuantizer(vecs.shape[1], faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(vecs)
+        index.add(vecs)
+        faiss.write_index(index, os.path.join(VECTOR_DB_DIR, DENSE_FAISS_FILE))
+    logging.info(f"Indice denso salvato ({codes.shape[0]} vettori int8, dimensione {codes.shape[1]}, FAISS={'sì' if faiss else 'no'}).")
+
 def build_vector_store():
     """Crea e salva il database vettoriale (Chroma) dagli 'chunks'."""
     
@@ -84,7 +132,7 @@ def build_vector_store():
     try:
         logging.info("Inizializzazione modello di embedding (text-embedding-004)...")
         # Istanzia embeddings lasciando che la libreria legga le env internamente
-        embeddings = GoogleGenerativeAIEmbeddings()  # type: ignore[call-arg]
+        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)  # type: ignore[call-arg]
     except Exception as e:
         logging.error(f"ERRORE CRITICO nella creazione di GoogleGenerativeAIEmbeddings: {e}")
         logging.error("Ciò potrebbe indicare una chiave API non valida o una versione obsoleta di 'langchain-google-genai'.")
@@ -103,12 +151,28 @@ def build_vector_store():
             embedding_function=embeddings
         )
         
-        # 2. Aggiungi i documenti al DB
+        # 2. Aggiungi i documenti al DB, calcolando gli embedding a blocchi di EMBED_BATCH_SIZE testi
         logging.info(f"Aggiunta di {len(chunks)} frammenti al database...")
-        db.add_documents(chunks)
+        texts = [c.page_content for c in chunks]
+        metadatas = [c.metadata for c in chunks]
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            end = start + EMBED_BATCH_SIZE
+            batch_vectors = embeddings.embed_documents(texts[start:end])
+            db._collection.add(
+                ids=[f"chunk-{start + j}" for j in range(len(batch_vectors))],
+                embeddings=batch_vectors,
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
+            vectors.extend(batch_vectors)
+            logging.info(f"Embedding calcolati: {min(end, len(texts))}/{len(texts)}")
         
         # 3. Salva (persisti) i dati su disco
         db.persist()
+
+        # 4. Esporta gli stessi embedding per l'indice denso in RAM usato dall'agente
+        save_dense_index(vectors, texts, metadatas)
         
         logging.info("✅ Indicizzazione completata con successo!")
         logging.info(f"Database salvato in: {VECTOR_DB_DIR}")
@@ -1,10 +1,282 @@
-import pandas as pd
 import os
+import io
+import re
+import csv
+import json
+import pickle
+import importlib.util
 import logging
 
 LOG_FILENAME = 'trading_log_avanzato.csv'
+PARQUET_LOG_FILENAME = 'trading_log_avanzato.parquet' # Preferito al CSV se presente e non più vecchio (richiede pyarrow, importato solo in quel caso)
 BALANCE_FILE = 'balance_data.txt'
 AGENT_LOG_FILE = 'trading_agent.log' # Per leggere le lezioni apprese
+REPORT_CACHE_FILE = '.perf_report_cache.pkl' # Aggregati dell'ultimo report, validi finché i file non cambiano
+REPORT_STATE_FILE = 'report_state.json' # Segnalibro (offset) e totali parziali del CSV, che è solo in append
+
+# Solo le colonne usate dal report
+ACCURACY_COLUMN = 'Accuratezza_Totale_%'
+NUMERIC_COLS = ['PNL_Realizzato_NETTO', 'Costo_Commissioni_Stimate']
+USECOLS = NUMERIC_COLS + [ACCURACY_COLUMN]
+# Dimensione dei blocchi letti dal CSV a partire dal segnalibro
+CSV_BLOCK_BYTES = 1 << 20
+# Byte che precedono il segnalibro salvati nello stato per riconoscere un CSV ricreato
+STATE_ANCHOR_BYTES = 256
+# File fino a questa dimensione sono letti con un'unica os.read invece che con open()/mmap
+SMALL_FILE_BYTES = 65536
+# Righe del log principale con le lezioni apprese dall'AI (scansione sui byte, in C)
+LESSON_TAG = b'LEZIONE APPRESA'
+LESSON_PATTERN = re.compile(re.escape(LESSON_TAG) + rb'(.*)')
+# Valori in balance_data.txt (formato 'chiave = valore')
+INITIAL_BALANCE_PATTERN = re.compile(r'^\s*initial_balance\s*=\s*([-+\d.eE]+)', re.M)
+FINAL_BALANCE_PATTERN = re.compile(r'^\s*final_balance\s*=\s*([-+\d.eE]+)', re.M)
+
+def _empty_summary() -> dict:
+    return {
+        'total_trades': 0,
+        'total_net_pnl': 0.0,
+        'total_commissions': 0.0,
+        'profitable_trades': 0,
+        'accuracy_last': None,
+    }
+
+def _pyarrow_available() -> bool:
+    """
+    pyarrow serve solo per il log Parquet: qui si controlla soltanto che sia installato,
+    l'import vero (centinaia di ms) avviene in _summarize_parquet.
+    """
+    try:
+        return importlib.util.find_spec('pyarrow') is not None
+    except ValueError: # Modulo già in sys.modules ma non importabile
+        return False
+
+def _use_parquet_log() -> bool:
+    """
+    Il log Parquet è preferito al CSV solo se non è più vecchio di quest'ultimo:
+    un file Parquet rimasto da una sessione precedente non deve congelare il report su dati vecchi.
+    """
+    if not os.path.exists(PARQUET_LOG_FILENAME) or not _pyarrow_available():
+        return False
+    if os.path.exists(LOG_FILENAME) and os.stat(PARQUET_LOG_FILENAME).st_mtime_ns < os.stat(LOG_FILENAME).st_mtime_ns:
+        logging.warning(f"{PARQUET_LOG_FILENAME} è più vecchio di {LOG_FILENAME}: uso il CSV.")
+        return False
+    return True
+
+def _summarize_parquet(path: str) -> dict:
+    """Aggrega il log Parquet leggendo solo le colonne del report, un row group alla volta."""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    summary = _empty_summary()
+    for batch in pq.ParquetFile(path).iter_batches(columns=USECOLS):
+        _accumulate_arrow_batch(summary, batch, pc)
+    return summary
+
+def _accumulate_arrow_batch(summary: dict, batch, pc) -> None:
+    n = batch.num_rows
+    if not n:
+        return
+    pnl = pc.fill_null(batch.column('PNL_Realizzato_NETTO'), 0.0)
+    summary['total_trades'] += n
+    summary['total_net_pnl'] += pc.sum(pnl).as_py() or 0.0
+    summary['total_commissions'] += pc.sum(batch.column('Costo_Commissioni_Stimate')).as_py() or 0.0
+    summary['profitable_trades'] += pc.sum(pc.greater(pnl, 0)).as_py() or 0
+    if ACCURACY_COLUMN in batch.schema.names:
+        accuracy = batch.column(ACCURACY_COLUMN)[n - 1].as_py()
+        # Il writer può salvare l'accuratezza come numero invece che come stringa '57.1%'
+        if accuracy is not None and not isinstance(accuracy, str):
+            accuracy = float(accuracy)
+        summary['accuracy_last'] = accuracy
+
+def _summarize_csv_rows(lines, column_names: list) -> dict:
+    """
+    Aggrega righe CSV (senza header) con csv.reader: somme e conteggi in un semplice ciclo Python.
+    Dell'accuratezza serve solo l'ultimo record, letto dall'ultima riga visitata dal ciclo.
+    """
+    i_pnl = column_names.index('PNL_Realizzato_NETTO')
+    i_com = column_names.index('Costo_Commissioni_Stimate')
+    n = profitable = 0
+    pnl_sum = com_sum = 0.0
+    last_row = None
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        # 'N/A', celle vuote o mancanti valgono 0
+        try:
+            pnl = float(row[i_pnl])
+        except (ValueError, IndexError):
+            pnl = 0.0
+        try:
+            com = float(row[i_com])
+        except (ValueError, IndexError):
+            com = 0.0
+        n += 1
+        pnl_sum += pnl
+        com_sum += com
+        profitable += pnl > 0
+        last_row = row
+    summary = _empty_summary()
+    summary.update(total_trades=n, total_net_pnl=pnl_sum, total_commissions=com_sum, profitable_trades=profitable)
+    if last_row is not None and ACCURACY_COLUMN in column_names:
+        i_acc = column_names.index(ACCURACY_COLUMN)
+        if i_acc < len(last_row) and last_row[i_acc] not in ('', 'N/A'):
+            summary['accuracy_last'] = last_row[i_acc]
+    return summary
+
+def _complete_records_end(buf: bytes) -> int:
+    """
+    Fine dell'ultimo record CSV completo in `buf` (che inizia a un confine di record).
+    Un a capo chiude un record solo fuori dalle virgolette, cioè con un numero pari di '"' prima.
+    """
+    end = buf.rfind(b'\n')
+    while end >= 0 and buf.count(b'"', 0, end) % 2:
+        end = buf.rfind(b'\n', 0, end)
+    return end + 1
+
+def _load_report_state(header: str, st: os.stat_result):
+    """
+    Restituisce lo stato salvato se si riferisce ancora allo stesso file: stesso header,
+    stesso inode/device e non troncato. I byte prima dell'offset sono verificati dal chiamante.
+    """
+    if not os.path.exists(REPORT_STATE_FILE):
+        return None
+    try:
+        with open(REPORT_STATE_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('header') != header or state.get('offset', st.st_size + 1) > st.st_size:
+        return None
+    if state.get('ino') != st.st_ino or state.get('dev') != st.st_dev:
+        return None
+    if any(key not in state for key in _empty_summary()):
+        return None
+    return state
+
+def _save_report_state(state: dict) -> None:
+    # Scrittura atomica: un'interruzione non lascia mai uno stato a metà
+    tmp_path = REPORT_STATE_FILE + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, REPORT_STATE_FILE)
+    except OSError as e:
+        logging.warning(f"Impossibile salvare lo stato del report: {e}")
+
+def _summarize_csv_incremental(path: str) -> dict:
+    """
+    Aggrega il CSV elaborando solo i byte aggiunti dall'ultima esecuzione.
+    Il file è scritto solo in append: i totali precedenti restano validi finché è lo stesso
+    file (header, inode e byte prima del segnalibro invariati) e non viene troncato;
+    altrimenti si riparte da zero.
+    """
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        header = f.readline().decode('utf-8').strip()
+        data_start = f.tell()
+        state = _load_report_state(header, st)
+        if state is not None:
+            # Un file ricreato può riusare l'inode: i byte prima del segnalibro devono coincidere
+            anchor_start = max(data_start, state['offset'] - STATE_ANCHOR_BYTES)
+            f.seek(anchor_start)
+            if f.read(state['offset'] - anchor_start).hex() != state.get('anchor'):
+                state = None
+        if state is None:
+            state = {'header': header, 'offset': data_start, 'ino': st.st_ino, 'dev': st.st_dev,
+                     'anchor': '', **_empty_summary()}
+        column_names = next(csv.reader([header]))
+        start_offset = state['offset']
+        f.seek(start_offset)
+        remaining = size - start_offset
+        carry = b''
+        # Lettura a blocchi di CSV_BLOCK_BYTES: la memoria resta O(blocco), non O(file)
+        while remaining > 0:
+            block = f.read(min(CSV_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            data = carry + block
+            # Solo record completi; il resto passa al blocco successivo (o, se è un record
+            # ancora in scrittura, sarà letto alla prossima esecuzione)
+            end = _complete_records_end(data)
+            records, carry = data[:end], data[end:]
+            if not records:
+                continue
+            new = _summarize_csv_rows(io.StringIO(records.decode('utf-8'), newline=''), column_names)
+            for key in ('total_trades', 'total_net_pnl', 'total_commissions', 'profitable_trades'):
+                state[key] += new[key]
+            if new['total_trades']:
+                state['accuracy_last'] = new['accuracy_last']
+            state['offset'] += len(records)
+            state['anchor'] = (bytes.fromhex(state['anchor']) + records[-STATE_ANCHOR_BYTES:])[-STATE_ANCHOR_BYTES:].hex()
+    if state['offset'] != start_offset:
+        _save_report_state(state)
+    return {key: state[key] for key in _empty_summary()}
+
+def _slurp(path: str) -> bytes:
+    """Legge un file piccolo con una sola chiamata di sistema, senza il livello di testo di open()."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, SMALL_FILE_BYTES)
+    finally:
+        os.close(fd)
+
+def _find_lessons(data) -> list:
+    """Cerca le lezioni in bytes o mmap; la regex parte dalla prima occorrenza del tag (find è una ricerca in C)."""
+    start = data.find(LESSON_TAG)
+    if start < 0:
+        return []
+    return [m.group(1).strip().decode('utf-8', 'replace') for m in LESSON_PATTERN.finditer(data, start)]
+
+def _read_lessons_learned() -> list:
+    """Estrae le "LEZIONI APPRESE" dal log principale dell'agente."""
+    if not os.path.exists(AGENT_LOG_FILE):
+        return []
+    size = os.path.getsize(AGENT_LOG_FILE)
+    if size == 0:
+        return []
+    try:
+        if size <= SMALL_FILE_BYTES:
+            return _find_lessons(_slurp(AGENT_LOG_FILE))
+        import mmap # Solo per i log grandi
+        fd = os.open(AGENT_LOG_FILE, os.O_RDONLY)
+        try:
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            try:
+                return _find_lessons(mm)
+            finally:
+                mm.close()
+        finally:
+            os.close(fd)
+    except Exception as e:
+        logging.error(f"Errore lettura {AGENT_LOG_FILE}: {e}")
+        return []
+
+def _report_cache_key() -> tuple:
+    """Impronta (mtime, dimensione) dei file di input: cambia appena uno di essi viene modificato."""
+    key = []
+    for path in (LOG_FILENAME, PARQUET_LOG_FILENAME, BALANCE_FILE, AGENT_LOG_FILE):
+        if os.path.exists(path):
+            st = os.stat(path)
+            key.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(key)
+
+def _load_report_cache(key: tuple):
+    if not os.path.exists(REPORT_CACHE_FILE):
+        return None
+    try:
+        with open(REPORT_CACHE_FILE, 'rb') as f:
+            cached = pickle.load(f)
+    except Exception:
+        return None
+    return cached['agg'] if cached.get('key') == key else None
+
+def _save_report_cache(key: tuple, agg: dict) -> None:
+    try:
+        with open(REPORT_CACHE_FILE, 'wb') as f:
+            pickle.dump({'key': key, 'agg': agg}, f)
+    except OSError as e:
+        logging.warning(f"Impossibile salvare la cache del report: {e}")
 
 def generate_report():
     """ 
@@ -20,17 +292,19 @@ def generate_report():
     
     if os.path.exists(BALANCE_FILE):
         try:
-            with open(BALANCE_FILE, 'r') as f:
-                for line in f:
-                    if 'initial_balance' in line:
-                        initial_balance = float(line.split('=')[1].strip())
-                    elif 'final_balance' in line:
-                        final_balance = float(line.split('=')[1].strip())
+            txt = _slurp(BALANCE_FILE).decode('ascii', 'replace')
+            # Come nella lettura riga per riga, vale l'ultimo valore presente nel file
+            values = INITIAL_BALANCE_PATTERN.findall(txt)
+            initial_balance = float(values[-1]) if values else 0.0
+            values = FINAL_BALANCE_PATTERN.findall(txt)
+            final_balance = float(values[-1]) if values else 0.0
         except Exception as e:
             logging.error(f"Errore lettura {BALANCE_FILE}: {e}")
     
-    # 2. Lettura log di trading (CSV)
-    if not os.path.exists(LOG_FILENAME) or os.path.getsize(LOG_FILENAME) < 150: # Dimensione minima header
+    # 2. Lettura log di trading (Parquet se disponibile, altrimenti CSV)
+    use_parquet = _use_parquet_log()
+    trade_log = PARQUET_LOG_FILENAME if use_parquet else LOG_FILENAME
+    if not use_parquet and (not os.path.exists(LOG_FILENAME) or os.path.getsize(LOG_FILENAME) < 150): # Dimensione minima header
         logging.info("\n=======================================================")
         logging.info("REPORT NON GENERATO: Nessun trade trovato in " + LOG_FILENAME)
         if initial_balance > 0 and final_balance > 0:
@@ -39,37 +313,40 @@ def generate_report():
         logging.info("=======================================================")
         return
 
-    try:
-        df = pd.read_csv(LOG_FILENAME)
-        if df.empty:
-            logging.info(f"{LOG_FILENAME} è vuoto. Nessun report da generare.")
+    # Se nessun file di input è cambiato dall'ultimo report, riusa gli aggregati salvati
+    cache_key = _report_cache_key()
+    cached = _load_report_cache(cache_key)
+    if cached is not None:
+        summary = cached['summary']
+    else:
+        try:
+            if use_parquet:
+                summary = _summarize_parquet(PARQUET_LOG_FILENAME)
+            else:
+                summary = _summarize_csv_incremental(LOG_FILENAME)
+            if summary['total_trades'] == 0:
+                logging.info(f"{trade_log} è vuoto. Nessun report da generare.")
+                return
+        except Exception as e:
+            logging.error(f"Errore imprevisto durante la lettura di {trade_log}: {e}")
             return
-    except pd.errors.EmptyDataError:
-        logging.info(f"{LOG_FILENAME} è vuoto o corrotto. Nessun report da generare.")
-        return
-    except Exception as e:
-        logging.error(f"Errore imprevisto durante la lettura di {LOG_FILENAME}: {e}")
-        return
 
-    # --- Calcoli dal DataFrame ---
-    
-    # Converte PNL e Commissioni in numerico, gestendo 'N/A' o stringhe
-    df['PNL_Realizzato_NETTO'] = pd.to_numeric(df['PNL_Realizzato_NETTO'], errors='coerce').fillna(0.0)
-    df['Costo_Commissioni_Stimate'] = pd.to_numeric(df['Costo_Commissioni_Stimate'], errors='coerce').fillna(0.0)
-    
-    total_trades = len(df)
-    total_net_pnl = df['PNL_Realizzato_NETTO'].sum()
-    total_commissions = df['Costo_Commissioni_Stimate'].sum()
+    # --- Calcoli dagli aggregati ---
+    total_trades = summary['total_trades']
+    total_net_pnl = summary['total_net_pnl']
+    total_commissions = summary['total_commissions']
     
     # Calcolo Accuratezza
-    profitable_trades = len(df[df['PNL_Realizzato_NETTO'] > 0])
+    profitable_trades = summary['profitable_trades']
     accuracy_avg = (profitable_trades / total_trades) * 100 if total_trades > 0 else 0.0
     
     # Cerca l'ultima accuratezza registrata
     try:
-        accuracy_last_str = df['Accuratezza_Totale_%'].iloc[-1].replace('%', '')
-        accuracy_last = float(accuracy_last_str)
-    except (IndexError, ValueError):
+        accuracy_last = summary['accuracy_last']
+        if isinstance(accuracy_last, str):
+            accuracy_last = accuracy_last.replace('%', '')
+        accuracy_last = float(accuracy_last)
+    except (IndexError, ValueError, TypeError, AttributeError):
         accuracy_last = accuracy_avg # Fallback
     
     # Calcolo P&L da bilancio (se disponibile)
@@ -80,46 +357,44 @@ def generate_report():
         logging.warning("Manca 'final_balance' in balance_data.txt. Il P&L da bilancio sarà 0.")
 
     # --- 3. Lettura Lezioni Apprese dal Log Principale ---
-    lessons_learned = []
-    if os.path.exists(AGENT_LOG_FILE):
-        try:
-            with open(AGENT_LOG_FILE, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if "LEZIONE APPRESA" in line:
-                        lesson_text = line.split("LEZIONE APPRESA", 1)[1].strip()
-                        lessons_learned.append(lesson_text)
-        except Exception as e:
-            logging.error(f"Errore lettura {AGENT_LOG_FILE}: {e}")
+    if cached is not None:
+        lessons_learned = cached['lessons_learned']
+    else:
+        lessons_learned = _read_lessons_learned()
+        _save_report_cache(cache_key, {'summary': summary, 'lessons_learned': lessons_learned})
 
     # --- OUTPUT REPORT ---
-    logging.info("\n\n=======================================================")
-    logging.info("📈 REPORT DI PERFORMANCE DELLA SESSIONE")
-    logging.info("=======================================================")
+    # Il report è composto in memoria ed emesso con una sola chiamata di logging (una scrittura)
+    lines = [
+        "\n\n=======================================================",
+        "📈 REPORT DI PERFORMANCE DELLA SESSIONE",
+        "=======================================================",
+    ]
     
     if initial_balance > 0:
-        logging.info(f"➡️ Capitale Iniziale (Net Liquidation): {initial_balance:.2f} USD")
+        lines.append(f"➡️ Capitale Iniziale (Net Liquidation): {initial_balance:.2f} USD")
         if final_balance > 0:
-            logging.info(f"➡️ Capitale Finale (Net Liquidation):   {final_balance:.2f} USD")
-        logging.info(f"-------------------------------------------------------")
+            lines.append(f"➡️ Capitale Finale (Net Liquidation):   {final_balance:.2f} USD")
+        lines.append("-------------------------------------------------------")
         if final_balance > 0:
-            logging.info(f"💰 P&L Totale da Bilancio (REALE):     {pnl_balance:+.2f} USD")
+            lines.append(f"💰 P&L Totale da Bilancio (REALE):     {pnl_balance:+.2f} USD")
         
-    logging.info(f"💰 P&L Totale da Log CSV (Netto):      {total_net_pnl:+.2f} USD")
-    logging.info(f"💸 Commissioni Totali Stimate (da CSV): {total_commissions:.2f} USD")
-    logging.info(f"-------------------------------------------------------")
-    logging.info(f"📊 Trade Totali Chiusi:                {total_trades}")
-    logging.info(f"✅ Trade Profittevoli:                {profitable_trades}")
-    logging.info(f"🎯 Accuratezza Finale:                {accuracy_last:.1f} %")
+    lines.append(f"💰 P&L Totale da Log CSV (Netto):      {total_net_pnl:+.2f} USD")
+    lines.append(f"💸 Commissioni Totali Stimate (da CSV): {total_commissions:.2f} USD")
+    lines.append("-------------------------------------------------------")
+    lines.append(f"📊 Trade Totali Chiusi:                {total_trades}")
+    lines.append(f"✅ Trade Profittevoli:                {profitable_trades}")
+    lines.append(f"🎯 Accuratezza Finale:                {accuracy_last:.1f} %")
     
-    logging.info("\n=======================================================")
-    logging.info("📚 RIEPILOGO LEZIONI APPRESE (DALL'AI)")
-    logging.info("=======================================================")
+    lines.append("\n=======================================================")
+    lines.append("📚 RIEPILOGO LEZIONI APPRESE (DALL'AI)")
+    lines.append("=======================================================")
     if lessons_learned:
-        for i, lesson in enumerate(lessons_learned, 1):
-            logging.info(f"{i}. {lesson}")
+        lines.extend(f"{i}. {lesson}" for i, lesson in enumerate(lessons_learned, 1))
     else:
-        logging.info("Nessuna lezione appresa trovata in 'trading_agent.log'.")
-    logging.info("=======================================================\n")
+        lines.append("Nessuna lezione appresa trovata in 'trading_agent.log'.")
+    lines.append("=======================================================\n")
+    logging.info("\n".join(lines))
 
 if __name__ == "__main__":
     generate_report()
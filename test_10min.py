@@ -8,8 +8,12 @@ import time
 import sys
 import csv
 from datetime import datetime
+from operator import itemgetter
 import signal
 
+# Colonne del CSV delle operazioni mostrate nel riepilogo (nell'ordine di estrazione)
+COLONNE_OPERAZIONI = ('timestamp', 'symbol', 'action', 'quantity', 'price', 'trading_decision', 'reasoning', 'pnl')
+
 def run_test():
     print("=" * 80)
     print("AVVIO TEST 10 MINUTI - Agente di Trading")
@@ -18,12 +22,12 @@ def run_test():
     print("L'agente verrà eseguito per 10 minuti...")
     print("-" * 80)
     
-    # Avvia l'agente
+    # Avvia l'agente: l'output non viene letto (l'agente scrive già su trading_agent.log),
+    # quindi va su DEVNULL per non bloccarlo quando il buffer di una pipe si riempie
     processo = subprocess.Popen(
         [sys.executable, "agente_analitico.py"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
     )
     
     try:
@@ -31,12 +35,18 @@ def run_test():
         tempo_attesa = 600
         print(f"Attesa di {tempo_attesa} secondi ({tempo_attesa//60} minuti)...")
         
-        # Monitora ogni 30 secondi
-        for i in range(0, tempo_attesa, 30):
-            time.sleep(30)
-            tempo_rimanente = tempo_attesa - i - 30
-            if tempo_rimanente > 0:
-                print(f"Tempo rimanente: {tempo_rimanente//60} minuti e {tempo_rimanente%60} secondi...")
+        # Attende la fine del processo a blocchi di 30 secondi (per il conto alla rovescia):
+        # se l'agente termina prima, l'attesa si interrompe subito
+        scadenza = time.monotonic() + tempo_attesa
+        while time.monotonic() < scadenza:
+            try:
+                processo.wait(timeout=min(30, scadenza - time.monotonic()))
+                print(f"\nL'agente è terminato in anticipo (codice di uscita {processo.returncode}).")
+                break
+            except subprocess.TimeoutExpired:
+                tempo_rimanente = int(scadenza - time.monotonic())
+                if tempo_rimanente > 0:
+                    print(f"Tempo rimanente: {tempo_rimanente//60} minuti e {tempo_rimanente%60} secondi...")
         
         print("\n" + "=" * 80)
         print("TEST COMPLETATO - Arresto agente...")
@@ -50,9 +60,7 @@ def run_test():
         time.sleep(2)
         if processo.poll() is None:
             processo.kill()
-        
-        # Raccogli output
-        stdout, stderr = processo.communicate(timeout=5)
+            processo.wait()
         
     # Mostra i risultati
     mostra_risultati()
@@ -67,45 +75,61 @@ def mostra_risultati():
     csv_file = "trading_log_avanzato.csv"
     
     try:
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            operazioni = list(reader)
+        # Una sola passata sul CSV senza caricare tutte le righe: si conservano solo
+        # i blocchi di testo da stampare dopo l'intestazione con il conteggio
+        numero_operazioni = 0
+        capitale_totale = 0.0
+        blocchi = []
+        with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            # Indici delle colonne calcolati una volta sola; una colonna assente punta
+            # alla cella sentinella 'N/A' aggiunta in coda a ogni riga
+            sentinella = len(header)
+            indici = []
+            for nome in COLONNE_OPERAZIONI:
+                try:
+                    indici.append(header.index(nome))
+                except ValueError:
+                    indici.append(sentinella)
+            estrai = itemgetter(*indici)
+            # filter(None, ...) salta le righe vuote, come faceva DictReader
+            for idx, row in enumerate(filter(None, reader), 1):
+                if len(row) != sentinella:
+                    row = (row + [''] * sentinella)[:sentinella] # Riga malformata: allinea all'header
+                row.append('N/A')
+                numero_operazioni = idx
+                timestamp, simbolo, azione, quantita, prezzo, decisione, motivo, pnl_grezzo = estrai(row)
+                # Solo i primi 100 caratteri del ragionamento (può essere lungo diversi KB)
+                motivo = (motivo or 'N/A')[:100]
+                
+                # Tenta di estrarre P&L se disponibile
+                try:
+                    pnl = float(pnl_grezzo or 0)
+                except ValueError:
+                    pnl = 0.0
+                capitale_totale += pnl
+                
+                # Un unico blocco di testo per operazione
+                riga_pnl = f"   P&L: ${pnl:.2f}\n" if pnl != 0.0 else ""
+                blocchi.append(
+                    f"\n{idx}. {timestamp}\n"
+                    f"   Simbolo: {simbolo} | Azione: {azione} | Quantità: {quantita}\n"
+                    f"   Prezzo: {prezzo} | Decisione: {decisione}\n"
+                    f"{riga_pnl}"
+                    f"   Motivo: {motivo}...\n"
+                )
         
-        if not operazioni:
+        if not numero_operazioni:
             print("Nessuna operazione completata durante il test.")
             return
         
-        print(f"NUMERO OPERAZIONI COMPLETATE: {len(operazioni)}\n")
+        print(f"NUMERO OPERAZIONI COMPLETATE: {numero_operazioni}\n")
         print("-" * 80)
         print("ELENCO OPERAZIONI:")
         print("-" * 80)
-        
-        capitale_totale = 0.0
-        
-        for idx, op in enumerate(operazioni, 1):
-            timestamp = op.get('timestamp', 'N/A')
-            simbolo = op.get('symbol', 'N/A')
-            azione = op.get('action', 'N/A')
-            quantita = op.get('quantity', 'N/A')
-            prezzo = op.get('price', 'N/A')
-            decisione = op.get('trading_decision', 'N/A')
-            motivo = op.get('reasoning', 'N/A')
-            
-            # Tenta di estrarre P&L se disponibile
-            pnl = 0.0
-            try:
-                if 'pnl' in op and op['pnl']:
-                    pnl = float(op['pnl'])
-                    capitale_totale += pnl
-            except:
-                pass
-            
-            print(f"\n{idx}. {timestamp}")
-            print(f"   Simbolo: {simbolo} | Azione: {azione} | Quantità: {quantita}")
-            print(f"   Prezzo: {prezzo} | Decisione: {decisione}")
-            if pnl != 0.0:
-                print(f"   P&L: ${pnl:.2f}")
-            print(f"   Motivo: {motivo[:100]}...")
+        # Una sola scrittura su stdout per tutto l'elenco
+        sys.stdout.write(''.join(blocchi))
         
         print("\n" + "=" * 80)
         print("RIEPILOGO FINANZIARIO")